@@ -1,9 +1,11 @@
 from datetime import UTC, datetime
+import heapq
 from io import BytesIO
+from itertools import islice
 from operator import attrgetter
 from pathlib import Path
 import time
-from typing import cast
+from typing import Iterator, cast
 from urllib.parse import urljoin
 from zoneinfo import ZoneInfo
 import click
@@ -17,6 +19,17 @@ from pydantic import BaseModel
 from slugify import slugify
 import stamina
 
+from p3news.resilience import (
+    RUN_BUDGET,
+    SOURCE_BUDGET,
+    Budget,
+    BudgetExceededError,
+    CircuitBreaker,
+    CircuitOpenError,
+    hedged_get,
+    is_transient,
+)
+
 
 class Article(BaseModel):
     title: str
@@ -44,6 +57,21 @@ class Article(BaseModel):
     type=click.Path(path_type=Path, dir_okay=False),
     help="Output file path for the feed",
 )
+@click.option(
+    "-n", "--feed-size", default=100, type=int, help="Number of articles in the feed"
+)
+@click.option(
+    "--run-budget",
+    default=RUN_BUDGET,
+    type=float,
+    help="Seconds the whole run can spend fetching",
+)
+@click.option(
+    "--source-budget",
+    default=SOURCE_BUDGET,
+    type=float,
+    help="Seconds a single source can spend fetching",
+)
 @click.option("-l", "--limit", default=1, type=float, help="How many articles to post")
 @click.option(
     "--server-url", default="https://mastodonczech.cz/", help="Mastodon server URL"
@@ -63,6 +91,9 @@ def main(
     pages: int,
     wait: float,
     output_path: Path,
+    feed_size: int,
+    run_budget: float,
+    source_budget: float,
     limit: int,
     server_url: str,
     access_token: str,
@@ -71,24 +102,12 @@ def main(
     today: datetime,
 ):
     cache = Cache(".cache")
+    breaker = CircuitBreaker(cache)
+    budget = Budget(run_budget)
 
     click.echo("Initializing file system")
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    click.echo("Fetching P3 news")
-    articles: list[Article] = []
-    for n in range(1, pages + 1):
-        url = url_template.format(n=n)
-        if response := cache.get(url):
-            click.echo(f"Using cached response for {url}")
-            response = cast(httpx.Response, response)
-        else:
-            click.echo(f"Fetching news page {url}")
-            response = download(url, user_agent, wait if n > 1 else None)
-            cache.set(url, response, expire=60 * 60)
-        click.echo("Parsing news page")
-        articles.extend(parse_page(response, today))
-
     # TODO refactor
     # TODO it's buggy, repeats over time
     # nt_feed_url = "https://www.nova-trojka.cz/index.php/feed/"
@@ -113,41 +132,49 @@ def main(
     #         )
     #     )
 
-    # TODO refactor
-    zd_feed_url = "https://zdopravy.cz/feed/"
-    if response := cache.get(zd_feed_url):
-        click.echo("Using cached response for Zdopravy.cz news")
-        response = cast(httpx.Response, response)
-    else:
-        click.echo("Fetching Zdopravy.cz news feed")
-        response = download(zd_feed_url, user_agent)
-    feed = feedparser.parse(response.content)
-    for entry in feed.entries:
-        tags = [tag.term for tag in entry.tags if tag not in ["seznam"]]
-        if "Praha 3" not in tags:
-            continue
-        # image_url = entry.enclosures[0].href
-        articles.append(
-            Article(
-                title=entry.title,
-                lead=entry.summary.strip(),
-                url=entry.link,
-                tags=tags,
-                published_at=datetime(*entry.published_parsed[:6], tzinfo=UTC),
-            )
+    click.echo("Fetching news")
+    # each source yields articles from the newest, so merging them lazily
+    # fetches only as many pages as the feed needs
+    articles = list(
+        islice(
+            heapq.merge(
+                fetch_praha3(
+                    url_template,
+                    pages,
+                    wait,
+                    user_agent,
+                    today,
+                    cache,
+                    breaker,
+                    Budget(source_budget, parent=budget),
+                ),
+                fetch_zdopravy(
+                    user_agent, cache, breaker, Budget(source_budget, parent=budget)
+                ),
+                key=attrgetter("published_at"),
+                reverse=True,
+            ),
+            feed_size,
         )
-
-    click.echo(f"Sorting {len(articles)} articles")
-    articles.sort(key=attrgetter("published_at"), reverse=True)
+    )
+    click.echo(f"Got {len(articles)} latest articles")
 
     click.echo("Fetching images")
+    images_budget = Budget(source_budget, parent=budget)
     for article in articles:
         if article.image_url:
             if response := cache.get(article.image_url):
                 click.echo(f"Using cached response for {article.image_url}")
             else:
                 click.echo(f"Fetching image {article.image_url}")
-                response = download(article.image_url, user_agent, wait)
+                try:
+                    response = download(
+                        article.image_url, user_agent, breaker, images_budget, wait
+                    )
+                except (CircuitOpenError, BudgetExceededError, httpx.HTTPError) as e:
+                    click.echo(f"Leaving out the image: {e}")
+                    article.image_url = None
+                    continue
                 cache.set(article.image_url, response, expire=60 * 60 * 24 * 30)
 
     click.echo("Generating feed")
@@ -196,13 +223,10 @@ def main(
             )
 
     click.echo("Posting articles")
-    articles = sorted(
-        [article for article in articles if article.url not in posted_urls],
-        key=attrgetter("published_at"),
+    articles = (
+        article for article in reversed(articles) if article.url not in posted_urls
     )
-    for i, article in enumerate(articles):
-        if i >= limit:
-            break
+    for article in islice(articles, int(limit)):
         media_ids = []
         if article.image_url:
             image_response = cast(httpx.Response, cache.get(article.image_url))
@@ -219,20 +243,109 @@ def main(
         )
 
 
-@stamina.retry(on=httpx.HTTPError, attempts=3)
-def download(url: str, user_agent: str, wait: float | None = None) -> httpx.Response:
+def fetch_praha3(
+    url_template: str,
+    pages: int,
+    wait: float,
+    user_agent: str,
+    today: datetime,
+    cache: Cache,
+    breaker: CircuitBreaker,
+    budget: Budget,
+) -> Iterator[Article]:
+    for n in range(1, pages + 1):
+        url = url_template.format(n=n)
+        if response := cache.get(url):
+            click.echo(f"Using cached response for {url}")
+            response = cast(httpx.Response, response)
+        else:
+            click.echo(f"Fetching news page {url}")
+            try:
+                response = download(
+                    url, user_agent, breaker, budget, wait if n > 1 else None
+                )
+            except (CircuitOpenError, BudgetExceededError, httpx.HTTPError) as e:
+                click.echo(f"Leaving out the rest of P3 news: {e}")
+                return
+            cache.set(url, response, expire=60 * 60)
+        click.echo("Parsing news page")
+        # pages are only close to being sorted (e.g. featured articles), so
+        # each is sorted before merging, otherwise one stale article on top
+        # would hold back all the newer ones behind it
+        yield from sorted(
+            parse_page(response, today), key=attrgetter("published_at"), reverse=True
+        )
+
+
+# TODO refactor
+def fetch_zdopravy(
+    user_agent: str, cache: Cache, breaker: CircuitBreaker, budget: Budget
+) -> Iterator[Article]:
+    zd_feed_url = "https://zdopravy.cz/feed/"
+    if response := cache.get(zd_feed_url):
+        click.echo("Using cached response for Zdopravy.cz news")
+        response = cast(httpx.Response, response)
+    else:
+        click.echo("Fetching Zdopravy.cz news feed")
+        try:
+            response = download(zd_feed_url, user_agent, breaker, budget)
+        except (CircuitOpenError, BudgetExceededError, httpx.HTTPError) as e:
+            click.echo(f"Leaving out Zdopravy.cz news: {e}")
+            return
+    feed = feedparser.parse(response.content)
+    articles = []
+    for entry in feed.entries:
+        tags = [tag.term for tag in entry.tags if tag not in ["seznam"]]
+        if "Praha 3" not in tags:
+            continue
+        # image_url = entry.enclosures[0].href
+        articles.append(
+            Article(
+                title=entry.title,
+                lead=entry.summary.strip(),
+                url=entry.link,
+                tags=tags,
+                published_at=datetime(*entry.published_parsed[:6], tzinfo=UTC),
+            )
+        )
+    # the feed comes in one response, so sorting it costs nothing extra
+    yield from sorted(articles, key=attrgetter("published_at"), reverse=True)
+
+
+@stamina.retry(on=is_transient, attempts=3)
+def download(
+    url: str,
+    user_agent: str,
+    breaker: CircuitBreaker,
+    budget: Budget,
+    wait: float | None = None,
+) -> httpx.Response:
+    # not retried by stamina, so an open circuit or a spent budget
+    # ends the retries right away
+    budget.check(url)
+    breaker.check(url)
     if wait:
         time.sleep(wait)
-    response = httpx.get(
-        url,
-        follow_redirects=True,
-        headers={
-            "User-Agent": user_agent,
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/png,image/svg+xml,*/*;q=0.8",
-        },
-        verify=False,
-    )
-    response.raise_for_status()
+    try:
+        response = hedged_get(
+            url,
+            budget,
+            follow_redirects=True,
+            headers={
+                "User-Agent": user_agent,
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/png,image/svg+xml,*/*;q=0.8",
+            },
+            verify=False,
+        )
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        # any response but a server error means the host is up
+        if isinstance(e, httpx.HTTPStatusError) and not e.response.is_server_error:
+            breaker.succeeded(url)
+        else:
+            breaker.failed(url)
+        raise
+    breaker.succeeded(url)
     return response
 
 
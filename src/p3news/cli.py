@@ -3,12 +3,13 @@ from datetime import datetime
 from importlib import import_module
 import json
 import logging
-from operator import attrgetter
 from pathlib import Path
 from typing import Annotated, Literal
 import click
 from pydantic import BaseModel, ConfigDict, HttpUrl, PlainSerializer
 
+from p3news.search import update_index
+
 
 logger = logging.getLogger(__name__)
 
@@ -75,10 +76,11 @@ class Article(BaseModel):
     default="site",
 )
 def build(input_path: Path, output_path: Path):
-    articles = map(Article.model_validate, json.loads(input_path.read_text()))
-    articles = sorted(articles, key=attrgetter("published_at"), reverse=True)
+    # no need to sort the whole archive, the search index sorts only new articles
+    articles = list(map(Article.model_validate, json.loads(input_path.read_text())))
     logger.info(f"Loaded {len(articles)} articles from {input_path}")
     output_path.mkdir(parents=True, exist_ok=True)
+    update_index(articles, output_path / "search")
     # TODO
 
 
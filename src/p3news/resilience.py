@@ -0,0 +1,237 @@
+"""Circuit breakers, latency budgets, and hedged requests
+
+Every outbound request should first pass the per-host circuit breaker and
+the latency budget of its source, which is itself capped by the budget of
+the whole run. A host which keeps failing gets its breaker open, so the
+rest of its requests and retries are skipped instead of waiting through the
+whole backoff schedule. The breaker state is persisted in the disk cache,
+so a host which was failing in the previous run gets probed just once.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+import functools
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+from crawlee.crawlers import AbstractHttpCrawler, BasicCrawlingContext
+from crawlee.errors import (
+    ContextPipelineInterruptedError,
+    HttpClientStatusCodeError,
+    HttpStatusCodeError,
+)
+from crawlee.router import Router
+from diskcache import Cache
+import httpx
+import impit
+
+
+logger = logging.getLogger(__name__)
+
+
+FAILURE_THRESHOLD = 3
+
+COOLDOWN = 60 * 60
+
+RUN_BUDGET = 15 * 60
+
+SOURCE_BUDGET = 3 * 60
+
+HEDGE_AFTER = 3
+
+TIMEOUT = 10
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class BudgetExceededError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        cache: Cache,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        cooldown: float = COOLDOWN,
+    ):
+        self.cache = cache
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+    def check(self, url: str) -> None:
+        key = get_breaker_key(url)
+        with self.cache.transact():
+            state = self.cache.get(key)
+            if not state or state["opened_at"] is None:
+                return
+            if time.time() - state["opened_at"] < self.cooldown:
+                raise CircuitOpenError(f"Circuit for {urlparse(url).hostname} is open")
+            # half-open, let this request probe the host and keep the rest
+            # waiting until the probe either closes the circuit or fails
+            logger.info(f"Probing {urlparse(url).hostname} with {url}")
+            self.cache.set(key, state | {"opened_at": time.time()})
+
+    def succeeded(self, url: str) -> None:
+        self.cache.delete(get_breaker_key(url))
+
+    def failed(self, url: str) -> None:
+        key = get_breaker_key(url)
+        with self.cache.transact():
+            state = self.cache.get(key) or {"failures": 0, "opened_at": None}
+            state["failures"] += 1
+            if state["failures"] >= self.failure_threshold:
+                if state["opened_at"] is None:
+                    logger.warning(f"Opening circuit for {urlparse(url).hostname}")
+                state["opened_at"] = time.time()
+            self.cache.set(key, state)
+
+
+class Budget:
+    def __init__(self, seconds: float, parent: "Budget | None" = None):
+        self.deadline = time.monotonic() + seconds
+        if parent:
+            self.deadline = min(self.deadline, parent.deadline)
+
+    @property
+    def remaining(self) -> float:
+        return max(0, self.deadline - time.monotonic())
+
+    def check(self, url: str) -> None:
+        if not self.remaining:
+            raise BudgetExceededError(f"Latency budget exceeded, not fetching {url}")
+
+
+class BreakerRouter(Router):
+    def __init__(self, breaker: CircuitBreaker):
+        super().__init__()
+        self.breaker = breaker
+
+    async def __call__(self, context: BasicCrawlingContext) -> None:
+        # getting to a handler means the host has responded fine
+        self.breaker.succeeded(context.request.url)
+        return await super().__call__(context)
+
+
+@functools.cache
+def get_breaker() -> CircuitBreaker:
+    return CircuitBreaker(Cache(".cache"))
+
+
+@functools.cache
+def get_run_budget() -> Budget:
+    return Budget(RUN_BUDGET)
+
+
+def get_breaker_key(url: str) -> str:
+    return f"breaker:{urlparse(url).hostname}"
+
+
+def protect(
+    crawler: AbstractHttpCrawler, budget_seconds: float = SOURCE_BUDGET
+) -> None:
+    breaker = get_breaker()
+    budget = Budget(budget_seconds, parent=get_run_budget())
+    crawler.router = BreakerRouter(breaker)
+
+    @crawler.pre_navigation_hook
+    async def check(context: BasicCrawlingContext) -> None:
+        try:
+            budget.check(context.request.url)
+            breaker.check(context.request.url)
+        except (BudgetExceededError, CircuitOpenError) as error:
+            logger.warning(f"Skipping {context.request.url}: {error}")
+            raise ContextPipelineInterruptedError(str(error)) from error
+
+    async def record_error(context: BasicCrawlingContext, error: Exception) -> None:
+        # a client error doesn't get to a handler, but the host has responded
+        if isinstance(error, HttpClientStatusCodeError):
+            breaker.succeeded(context.request.url)
+        elif is_host_failure(error):
+            breaker.failed(context.request.url)
+
+    crawler.error_handler(record_error)
+    crawler.failed_request_handler(record_error)
+
+
+def is_host_failure(error: Exception) -> bool:
+    # handler timeouts or local storage errors are not the host's fault,
+    # so only server errors and transport errors of the HTTP clients count
+    # (impit is the default one in crawlee, praha3 uses httpx)
+    if isinstance(error, HttpClientStatusCodeError):
+        return False
+    return isinstance(
+        error, (HttpStatusCodeError, httpx.TransportError, impit.TransportError)
+    )
+
+
+def is_transient(error: Exception) -> bool:
+    # client errors are final, retrying a 404 only burns the backoff schedule
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.is_server_error
+    return isinstance(error, httpx.TransportError)
+
+
+def hedged_get(
+    url: str, budget: Budget, hedge_after: float = HEDGE_AFTER, **kwargs
+) -> httpx.Response:
+    executor = ThreadPoolExecutor(max_workers=2)
+    finished = threading.Event()
+
+    def send() -> Future:
+        timeout = min(TIMEOUT, budget.remaining)
+        return executor.submit(get, url, budget, finished, timeout=timeout, **kwargs)
+
+    try:
+        futures = [send()]
+        hedge_wait = min(hedge_after, budget.remaining)
+        if not wait(futures, timeout=hedge_wait).done and budget.remaining:
+            logger.info(f"No response from {url} in {hedge_wait:.1f}s, hedging")
+            futures.append(send())
+        error = None
+        try:
+            for future in as_completed(futures, timeout=budget.remaining):
+                try:
+                    return future.result()
+                except (httpx.HTTPError, BudgetExceededError) as e:
+                    error = e
+        except TimeoutError:
+            raise BudgetExceededError(
+                f"Latency budget exceeded while fetching {url}"
+            ) from None
+        raise error
+    finally:
+        # don't wait for the slower of the two requests, just make it stop
+        finished.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get(
+    url: str, budget: Budget, finished: threading.Event, timeout: float, **kwargs
+) -> httpx.Response:
+    try:
+        with httpx.stream("GET", url, timeout=timeout, **kwargs) as response:
+            chunks = []
+            # httpx timeouts apply to each read separately, so a response
+            # dripping slowly would never trip them, hence the deadline here
+            for chunk in response.iter_raw():
+                if finished.is_set() or not budget.remaining:
+                    raise BudgetExceededError(
+                        f"Latency budget exceeded while fetching {url}"
+                    )
+                chunks.append(chunk)
+    except httpx.TimeoutException as e:
+        # a timeout cut short by the budget says nothing about the host
+        if timeout < TIMEOUT:
+            raise BudgetExceededError(
+                f"Latency budget exceeded while fetching {url}"
+            ) from e
+        raise
+    return httpx.Response(
+        response.status_code,
+        headers=response.headers,
+        content=b"".join(chunks),
+        request=response.request,
+    )
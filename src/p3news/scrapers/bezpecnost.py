@@ -1,76 +1,147 @@
-from datetime import date, timedelta
+from datetime import UTC, date, datetime, timedelta
 import json
 import logging
 from bs4 import BeautifulSoup
-from crawlee import Request
+from crawlee import ConcurrencySettings, Request
 from crawlee.crawlers import HttpCrawler, HttpCrawlingContext
+from crawlee.storages import KeyValueStore
+
+from p3news.resilience import protect
 
 
 logger = logging.getLogger(__name__)
 
 
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:143.0) Gecko/20100101 Firefox/143.0",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.8,cs;q=0.6,sk;q=0.4,es;q=0.2",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "DNT": "1",
+    "Sec-GPC": "1",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "Priority": "u=0, i",
+}
+
+
 async def main(
-    date_from: date | None = None, date_to: date | None = None
+    date_from: date | None = None,
+    date_to: date | None = None,
+    window_days: int = 7,
+    today: date | None = None,
 ) -> list[dict]:
-    date_from = date_from or (date.today() - timedelta(days=30))
-    date_to = date_to or (date.today() + timedelta(days=5))
+    # the API takes the window boundaries in UTC
+    today = today or datetime.now(UTC).date()
+    date_from = date_from or (today - timedelta(days=30))
+    date_to = date_to or (today + timedelta(days=5))
+
+    # windows which ended before the high-water mark don't change anymore,
+    # their items are kept in the store from the previous runs
+    store = await KeyValueStore.open(name="bezpecnost")
+    high_water_mark = await store.get_value("high_water_mark")
+    high_water_mark = date.fromisoformat(high_water_mark) if high_water_mark else None
 
-    crawler = HttpCrawler(configure_logging=False)
+    windows = list(get_windows(date_from, date_to, window_days))
+    items_by_window: dict[date, list[dict]] = {}
+    requests = []
+    for window_from, window_to in windows:
+        if high_water_mark and window_to <= high_water_mark:
+            items = await store.get_value(get_window_key(window_from))
+            if items is not None:
+                items_by_window[window_from] = items
+                continue
+        requests.append(
+            Request.from_url(
+                get_url(window_from, window_to),
+                headers=HEADERS,
+                user_data={"window_from": window_from.isoformat()},
+            )
+        )
+    logger.info(
+        f"Fetching {len(requests)} of {len(windows)} windows, "
+        f"high-water mark: {high_water_mark or 'none'}"
+    )
+
+    crawler = HttpCrawler(
+        configure_logging=False,
+        concurrency_settings=ConcurrencySettings(max_concurrency=5),
+    )
+    protect(crawler)
 
     @crawler.router.default_handler
     async def default_handler(context: HttpCrawlingContext) -> None:
-        text = (await context.http_response.read()).decode()
-        print(text)
-        # data = json.loads(text)
-        # events = [
-        #     event
-        #     for event in data["events"]
-        #     if event.get("administrativeDistrict") == "Praha 3"
-        # ]
-        # for event in events:
-        #     lead_soup = BeautifulSoup(event["description"], "html.parser")
-        #     lead = lead_soup.get_text(" ", strip=True)
-        #     await context.push_data(
-        #         {
-        #             "title": event["title"],
-        #             "lead": lead,
-        #             "url": f"https://bezpecnost.praha.eu/udalosti/{event['relativeUrl']}",
-        #             "tags": [event["type"]],
-        #             "published_at": event["publication"]["date"],
-        #             "lang": "cs",
-        #         }
-        #     )
-
-    url = (
+        window_from = date.fromisoformat(context.request.user_data["window_from"])
+        data = json.loads(await context.http_response.read())
+        items_by_window[window_from] = [
+            parse_event(event)
+            for event in data["events"]
+            if event.get("administrativeDistrict") == "Praha 3"
+        ]
+
+    if requests:
+        await crawler.run(requests)
+
+    for window_from, window_to in windows:
+        if window_from not in items_by_window:
+            break
+        await store.set_value(
+            get_window_key(window_from), items_by_window[window_from]
+        )
+        # events can still be entered or edited for a while after they
+        # happened, so windows get one more window of time before freezing
+        if window_to <= today - timedelta(days=window_days):
+            high_water_mark = max(high_water_mark or window_to, window_to)
+    if high_water_mark:
+        await store.set_value("high_water_mark", high_water_mark.isoformat())
+
+    # events lasting over more days can be returned by adjacent windows
+    items = {
+        item["url"]: item
+        for window_from, _ in windows
+        for item in items_by_window.get(window_from, [])
+    }
+    logger.info(f"Scraped {len(items)} items")
+    return list(items.values())
+
+
+def get_windows(date_from: date, date_to: date, window_days: int):
+    # aligned to a fixed grid (weeks start on Mondays), so that the windows
+    # stay the same as the date range moves day by day
+    ordinal = date_from.toordinal()
+    window_from = date.fromordinal(ordinal - (ordinal - 1) % window_days)
+    while window_from < date_to:
+        window_to = min(window_from + timedelta(days=window_days), date_to)
+        yield window_from, window_to
+        window_from = window_to
+
+
+def get_window_key(window_from: date) -> str:
+    return f"window-{window_from.isoformat()}"
+
+
+def get_url(date_from: date, date_to: date) -> str:
+    return (
         "https://bezpecnost.praha.eu/Intens.CrisisPortalInfrastructureApp/events"
         f"?from={date_from.isoformat()}T00:00:00.000Z&to={date_to.isoformat()}T00:00:00.000Z"
         "&groupType=OSKS_ACTUALITY&showHistory=true&format=json"
     )
-    await crawler.run(
-        [
-            Request.from_url(
-                url,
-                headers={
-                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:143.0) Gecko/20100101 Firefox/143.0",
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                    "Accept-Language": "en-US,en;q=0.8,cs;q=0.6,sk;q=0.4,es;q=0.2",
-                    "Accept-Encoding": "gzip, deflate, br, zstd",
-                    "DNT": "1",
-                    "Sec-GPC": "1",
-                    "Connection": "keep-alive",
-                    "Upgrade-Insecure-Requests": "1",
-                    "Sec-Fetch-Dest": "document",
-                    "Sec-Fetch-Mode": "navigate",
-                    "Sec-Fetch-Site": "none",
-                    "Sec-Fetch-User": "?1",
-                    "Priority": "u=0, i",
-                },
-            )
-        ]
-    )
-    data = await crawler.get_data()
-    logger.info(f"Scraped {len(data.items)} items")
-    return data.items
+
+
+def parse_event(event: dict) -> dict:
+    lead_soup = BeautifulSoup(event["description"], "html.parser")
+    return {
+        "title": event["title"],
+        "lead": lead_soup.get_text(" ", strip=True),
+        "url": f"https://bezpecnost.praha.eu/udalosti/{event['relativeUrl']}",
+        "tags": [event["type"]],
+        "published_at": event["publication"]["date"],
+        "lang": "cs",
+    }
 
 
 if __name__ == "__main__":
@@ -4,12 +4,15 @@ from urllib.parse import urljoin
 from zoneinfo import ZoneInfo
 from crawlee.crawlers import BeautifulSoupCrawler, BeautifulSoupCrawlingContext
 
+from p3news.resilience import protect
+
 
 logger = logging.getLogger(__name__)
 
 
 async def main() -> list[dict]:
     crawler = BeautifulSoupCrawler(configure_logging=False)
+    protect(crawler)
 
     @crawler.router.default_handler
     async def default_handler(context: BeautifulSoupCrawlingContext) -> None:
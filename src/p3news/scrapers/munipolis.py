@@ -6,6 +6,8 @@ from zoneinfo import ZoneInfo
 from crawlee import Request
 from crawlee.crawlers import HttpCrawler, HttpCrawlingContext
 
+from p3news.resilience import protect
+
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +19,7 @@ async def main(
     date_to = date_to or (date.today() + timedelta(days=5))
 
     crawler = HttpCrawler(configure_logging=False)
+    protect(crawler)
 
     @crawler.router.default_handler
     async def default_handler(context: HttpCrawlingContext) -> None:
@@ -5,12 +5,15 @@ from crawlee import Request
 from crawlee.crawlers import HttpCrawler, HttpCrawlingContext
 import feedparser
 
+from p3news.resilience import protect
+
 
 logger = logging.getLogger(__name__)
 
 
 async def main() -> list[dict]:
     crawler = HttpCrawler(configure_logging=False)
+    protect(crawler)
 
     @crawler.router.default_handler
     async def default_handler(context: HttpCrawlingContext) -> None:
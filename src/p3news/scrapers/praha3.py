@@ -5,6 +5,8 @@ from crawlee import Request
 from crawlee.crawlers import BeautifulSoupCrawler, BeautifulSoupCrawlingContext
 from crawlee.http_clients import HttpxHttpClient
 
+from p3news.resilience import protect
+
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +14,7 @@ logger = logging.getLogger(__name__)
 async def main(pages: int = 5) -> list[dict]:
     http_client = HttpxHttpClient(verify=False)  # crawlee bug?
     crawler = BeautifulSoupCrawler(configure_logging=False, http_client=http_client)
+    protect(crawler)
 
     @crawler.router.default_handler
     async def default_handler(context: BeautifulSoupCrawlingContext) -> None:
@@ -0,0 +1,268 @@
+"""Static full-text search index for the generated site
+
+The index lives in a directory (``site/search/`` by default) and is made of
+plain JSON files, so that it can be served by any static hosting:
+
+- ``manifest.json`` holds the format parameters, the stopwords, and the list
+  of shards,
+- ``terms/<prefix>.json`` maps normalized terms starting with ``<prefix>``
+  to sorted lists of document IDs. Shards start with two letter prefixes
+  and split into longer ones as they grow over ``MAX_SHARD_SIZE``, so each
+  term belongs to the shard with the longest prefix listed in the manifest,
+- ``docs/<n>.json`` holds metadata of documents with IDs from
+  ``n * DOCS_CHUNK_SIZE`` to ``(n + 1) * DOCS_CHUNK_SIZE - 1``.
+
+To search, the browser normalizes the query with the same rules as
+:func:`normalize`, drops the stopwords, loads only the shards of the query
+terms, intersects the postings, and then loads only the document chunks it
+needs to display.
+"""
+
+from collections import defaultdict
+import json
+import logging
+from operator import attrgetter
+from pathlib import Path
+import re
+from typing import TYPE_CHECKING, Iterable
+import unicodedata
+
+
+if TYPE_CHECKING:
+    from p3news.cli import Article
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMAT_VERSION = 4
+
+SHARD_PREFIX_LENGTH = 2
+
+DOCS_CHUNK_SIZE = 100
+
+MAX_SHARD_SIZE = 16 * 1024
+
+MIN_TERM_LENGTH = 2
+
+MIN_STEM_LENGTH = 3
+
+# Czech case endings with diacritics already folded, following the light
+# stemmer by Dolamic & Savoy, longer endings first
+CASE_SUFFIXES = [
+    "atech",
+    "etem", "atum",
+    "ech", "ich", "eho", "emi", "emu", "ete", "eti", "iho", "imi", "imu",
+    "ach", "ata", "aty", "ych", "ama", "ami", "ove", "ovi", "ymi",
+    "em", "es", "im", "um", "at", "am", "ym", "mi", "ou",
+    "a", "e", "i", "o", "u", "y",
+]
+
+# possessive endings, stripped in a separate pass after the case endings
+POSSESSIVE_SUFFIXES = ["ov", "in", "uv"]
+
+# words present in almost every article, with diacritics already folded,
+# both Czech and English as some of the sources are in English
+STOPWORDS = {
+    "aby", "ale", "ani", "ano", "asi", "az", "bez", "bude", "budou", "by",
+    "byl", "byla", "byli", "bylo", "byt", "ci", "co", "do", "jak", "jako",
+    "je", "jeho", "jej", "jeji", "jejich", "jen", "jeste", "ji", "jiz", "jsem",
+    "jsme", "jsou", "kam", "kde", "kdy", "kdyz", "ke", "kolem", "ktera",
+    "ktere", "kteri", "kterou", "ktery", "kvuli", "ma", "maji", "mezi", "mu",
+    "na", "nad", "nam", "ne", "nebo", "neni", "nez", "od", "po", "pod",
+    "podle", "pokud", "pouze", "pred", "pri", "pro", "proti", "protoze", "se",
+    "si", "sve", "ta", "tak", "take", "tam", "te", "tedy", "ten", "to", "tom",
+    "tomu", "toto", "tu", "tuto", "ty", "uz", "ve", "vsak", "za", "ze", "zde",
+    "an", "and", "are", "as", "at", "be", "for", "from", "has", "have", "in",
+    "is", "it", "its", "of", "on", "or", "that", "the", "this", "was",
+    "were", "will", "with",
+}
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def stem(word: str) -> str:
+    return strip_suffix(strip_suffix(word, CASE_SUFFIXES), POSSESSIVE_SUFFIXES)
+
+
+def strip_suffix(word: str, suffixes: list[str]) -> str:
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            return word[: -len(suffix)]
+    return word
+
+
+def normalize(text: str) -> list[str]:
+    """
+    >>> normalize("Žižkov Žižkova Žižkově Žižkovem Žižkovu")
+    ['zizk', 'zizk', 'zizk', 'zizk', 'zizk']
+    >>> normalize("autobus autobusy autobusem autobusu autobusech autobusům")
+    ['autobus', 'autobus', 'autobus', 'autobus', 'autobus', 'autobus']
+    >>> normalize("Autobusy na Žižkově se vrací do ulic")
+    ['autobus', 'zizk', 'vrac', 'ulic']
+    >>> normalize("Praha 3, Praha3")
+    ['prah', '3', 'praha3']
+    """
+    return [
+        stem(token)
+        for token in TOKEN_RE.findall(fold(text))
+        # numbers are kept however short, as in "Praha 3"
+        if (len(token) >= MIN_TERM_LENGTH or token.isdigit())
+        and token not in STOPWORDS
+    ]
+
+
+def get_shard_name(term: str, shards: set[str]) -> str:
+    for length in range(len(term), SHARD_PREFIX_LENGTH, -1):
+        if term[:length] in shards:
+            return term[:length]
+    return term[:SHARD_PREFIX_LENGTH]
+
+
+def get_terms(article: "Article") -> set[str]:
+    texts = [article.title, article.lead or "", article.author or "", *article.tags]
+    return {term for text in texts for term in normalize(text)}
+
+
+def update_index(articles: Iterable["Article"], index_path: Path) -> int:
+    manifest_path = index_path / "manifest.json"
+    docs_path = index_path / "docs"
+    terms_path = index_path / "terms"
+
+    manifest = read_json(manifest_path)
+    if manifest and manifest["version"] != FORMAT_VERSION:
+        logger.warning(f"Search index format changed, rebuilding {index_path}")
+        manifest = None
+    if manifest is None:
+        for path in [*docs_path.glob("*.json"), *terms_path.glob("*.json")]:
+            path.unlink()
+        manifest = {
+            "version": FORMAT_VERSION,
+            "shard_prefix_length": SHARD_PREFIX_LENGTH,
+            "docs_chunk_size": DOCS_CHUNK_SIZE,
+            "stopwords": sorted(STOPWORDS),
+            "docs_count": 0,
+            "shards": [],
+        }
+
+    # the manifest is written last, so only documents counted in it are
+    # indexed, anything beyond is a leftover of an interrupted build
+    docs_count = manifest["docs_count"]
+    docs_by_chunk = {
+        int(path.stem): read_json(path) for path in docs_path.glob("*.json")
+    }
+    if sum(len(docs) for docs in docs_by_chunk.values()) > docs_count:
+        logger.warning(f"Cleaning up after an interrupted build of {index_path}")
+        remove_leftovers(docs_path, terms_path, docs_count)
+        docs_by_chunk = {
+            chunk: docs[: max(0, docs_count - chunk * DOCS_CHUNK_SIZE)]
+            for chunk, docs in docs_by_chunk.items()
+        }
+
+    # only the URLs are needed to tell which articles are new
+    indexed_urls = {doc["url"] for docs in docs_by_chunk.values() for doc in docs}
+    new_articles = [
+        article for article in articles if str(article.url) not in indexed_urls
+    ]
+    if not new_articles:
+        logger.info("Search index is up to date")
+        return 0
+
+    doc_id = docs_count
+    shards = set(manifest["shards"])
+    new_docs: dict[int, list[dict]] = defaultdict(list)
+    new_postings: dict[str, dict[str, list[int]]] = defaultdict(
+        lambda: defaultdict(list)
+    )
+    # oldest first, so that IDs grow with time as the archive does
+    for article in sorted(new_articles, key=attrgetter("published_at")):
+        new_docs[doc_id // DOCS_CHUNK_SIZE].append(
+            {
+                "title": article.title,
+                "url": str(article.url),
+                "published_at": article.published_at.isoformat(),
+            }
+        )
+        for term in get_terms(article):
+            new_postings[get_shard_name(term, shards)][term].append(doc_id)
+        doc_id += 1
+
+    docs_path.mkdir(parents=True, exist_ok=True)
+    for chunk, docs in new_docs.items():
+        write_json(docs_path / f"{chunk}.json", docs_by_chunk.get(chunk, []) + docs)
+
+    terms_path.mkdir(parents=True, exist_ok=True)
+    for shard, postings in new_postings.items():
+        shard_postings = read_json(terms_path / f"{shard}.json") or {}
+        for term, doc_ids in postings.items():
+            shard_postings[term] = shard_postings.get(term, []) + doc_ids
+        write_shard(terms_path, shard, shard_postings, shards)
+
+    manifest["docs_count"] = doc_id
+    manifest["shards"] = sorted(shards)
+    write_json(manifest_path, manifest)
+
+    logger.info(
+        f"Indexed {len(new_articles)} new articles, "
+        f"touched {len(new_postings)} of {len(manifest['shards'])} shards"
+    )
+    return len(new_articles)
+
+
+def write_shard(
+    terms_path: Path, shard: str, postings: dict[str, list[int]], shards: set[str]
+) -> None:
+    shards.add(shard)
+    if len(dump_json(postings).encode()) > MAX_SHARD_SIZE:
+        # the longer terms move to shards with one more letter in the prefix,
+        # written before the shrunk one, so that no term is ever missing
+        children: dict[str, dict[str, list[int]]] = defaultdict(dict)
+        for term in [term for term in postings if len(term) > len(shard)]:
+            children[term[: len(shard) + 1]][term] = postings.pop(term)
+        for child, child_postings in children.items():
+            existing_postings = read_json(terms_path / f"{child}.json") or {}
+            for term, doc_ids in existing_postings.items():
+                child_postings[term] = sorted(
+                    set(child_postings.get(term, [])) | set(doc_ids)
+                )
+            write_shard(terms_path, child, child_postings, shards)
+    write_json(terms_path / f"{shard}.json", dict(sorted(postings.items())))
+
+
+def remove_leftovers(docs_path: Path, terms_path: Path, docs_count: int) -> None:
+    for path in docs_path.glob("*.json"):
+        chunk_docs_count = docs_count - int(path.stem) * DOCS_CHUNK_SIZE
+        if chunk_docs_count <= 0:
+            path.unlink()
+        else:
+            write_json(path, read_json(path)[:chunk_docs_count])
+    for path in terms_path.glob("*.json"):
+        postings = {
+            term: [doc_id for doc_id in doc_ids if doc_id < docs_count]
+            for term, doc_ids in read_json(path).items()
+        }
+        write_json(path, {term: ids for term, ids in postings.items() if ids})
+
+
+def read_json(path: Path):
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+
+
+def write_json(path: Path, data) -> None:
+    # written aside and renamed, so that no file is ever left half-written
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(dump_json(data))
+    tmp_path.replace(path)
+
+
+def dump_json(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))